@@ -1,30 +1,387 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
+import numpy as np
+import xlsxwriter
+import zipfile
 from io import BytesIO
 
+# Copy-on-Write is always on from pandas 3.0; opt in on 2.x so filtered frames
+# share memory with their parent until a column is written
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+try:
+    import python_calamine  # noqa: F401 - Rust xlsx reader used by pandas
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+
+# Columns the algorithm reads from the Endcaps file
+ENDCAPS_COLUMNS = ["Storage Type", "Storage Unit", "Storage Bin", "Material", "Batch", "Total Stock"]
+ENDCAPS_TEXT_COLUMNS = ["Storage Unit", "Storage Bin", "Material", "Batch"]
+# Columns the algorithm reads from the Open Space file; it keeps every other column
+# too since it is written back out as "Updated Open Space"
+OPEN_SPACE_COLUMNS = [
+    "Storage Type", "Storage Bin", "Material Number", "Batch Number",
+    "SU Count", "SU Capacity", "Avail SU", "Utilization %"
+]
+OPEN_SPACE_TEXT_COLUMNS = ["Material Number", "Batch Number"]
+# Whole-number Open Space counts; int32 halves their size (Utilization % stays float64
+# so the percentages written back out are unchanged)
+OPEN_SPACE_COUNT_COLUMNS = ["SU Count", "SU Capacity", "Avail SU"]
+
+# Text columns are Arrow-backed so strip/compare run in C instead of per Python object
+TEXT_DTYPE = "string[pyarrow]"
+
+# Column order of the "Summary Report" sheet
+SUMMARY_COLUMNS = [
+    "FROM STORAGE TYPE", "TO STORAGE TYPE", "Material",
+    "FROM OLDEST BATCH", "FROM NEWEST BATCH", "TO OLDEST BATCH", "TO NEWEST BATCH",
+    "SU CAPACITY", "CURRENT SU COUNT", "AVAILABLE SU", "SUs TO MOVE", "FROM LOC", "TO LOC"
+]
+
+# Low-cardinality columns are stored as category so filters compare integer codes
+CATEGORY_COLUMNS = ["Storage Type"]
+
+def to_shared_category(*columns):
+    """Cast columns to one CategoricalDtype so values compare equal across frames"""
+    categories = pd.concat(columns, ignore_index=True).dropna().unique()
+    dtype = pd.CategoricalDtype(categories)
+    return [column.astype(dtype) for column in columns]
+
 # --- Cached Data Loading Functions ---
-@st.cache_data(ttl=3600, show_spinner=False)
+# Parsed uploads are also pickled to ~/.streamlit/cache keyed by file content, so a
+# restart or another session skips the xlsx parse. That disk cache is persistent and
+# unbounded: Streamlit never evicts it (ttl is ignored with persist, and max_entries
+# only caps the in-memory layer), so every distinct workbook stays there until it is
+# cleared with `streamlit cache clear` or the app menu's "Clear cache"
+@st.cache_data(persist="disk", max_entries=20, show_spinner=False)
 def load_endcaps_data(uploaded_file):
     """Cached function to load endcaps data"""
-    return pd.read_excel(uploaded_file, sheet_name="Sheet1")
+    return pd.read_excel(
+        uploaded_file,
+        sheet_name="Sheet1",
+        engine=EXCEL_ENGINE,
+        # A callable keeps missing columns out of read_excel so the UI can name them
+        usecols=lambda col: col in ENDCAPS_COLUMNS,
+        dtype={**{col: TEXT_DTYPE for col in ENDCAPS_TEXT_COLUMNS},
+               **{col: "category" for col in CATEGORY_COLUMNS}}
+    )
 
-@st.cache_data(ttl=3600, show_spinner=False)
+@st.cache_data(persist="disk", max_entries=20, show_spinner=False)
 def load_open_space_data(uploaded_file):
     """Cached function to load open space data"""
-    return pd.read_excel(uploaded_file, sheet_name="Sheet1")
+    return pd.read_excel(
+        uploaded_file,
+        sheet_name="Sheet1",
+        engine=EXCEL_ENGINE,
+        dtype={**{col: TEXT_DTYPE for col in OPEN_SPACE_TEXT_COLUMNS},
+               **{col: "category" for col in CATEGORY_COLUMNS}}
+    )
+
+# Each cache hit on a loader unpickles a full copy of the frame, so the UI reads the
+# header and filter options through these instead (inferred categories are unique and sorted)
+@st.cache_data(show_spinner=False)
+def load_endcaps_columns(uploaded_file):
+    """Cached column names of the endcaps data"""
+    return load_endcaps_data(uploaded_file).columns.tolist()
+
+@st.cache_data(show_spinner=False)
+def load_open_space_columns(uploaded_file):
+    """Cached column names of the open space data"""
+    return load_open_space_data(uploaded_file).columns.tolist()
+
+@st.cache_data(show_spinner=False)
+def load_endcaps_storage_types(uploaded_file):
+    """Cached Storage Type options of the endcaps data"""
+    return load_endcaps_data(uploaded_file)["Storage Type"].cat.categories.tolist()
+
+@st.cache_data(show_spinner=False)
+def load_open_space_storage_types(uploaded_file):
+    """Cached Storage Type options of the open space data"""
+    return load_open_space_data(uploaded_file)["Storage Type"].cat.categories.tolist()
+
+def parse_batch_vectorized(batches):
+    """Split a column of batch strings into prefix and week-start date"""
+    # A batch repeats across its SUs, so parse each distinct string once and take back per row
+    codes, distinct = pd.factorize(batches, use_na_sentinel=False)
+    distinct = pd.Series(distinct)
+    valid = distinct.str.len() >= 10
+    prefix = distinct.str[:2].where(valid)
+    week = distinct.str[-4:-2].str.strip()
+    dates = pd.to_datetime(
+        "20" + distinct.str[-2:] + "-W" + week + "-1",
+        format="%Y-W%W-%w",
+        errors="coerce"
+    )
+    # Week 00 is the Monday on or before Jan 1 (pandas clamps it to Jan 1)
+    week_zero = week.isin(["0", "00"])
+    dates = dates.mask(week_zero, dates - pd.to_timedelta(dates.dt.dayofweek, unit="D"))
+    parsed = pd.DataFrame({"Batch Prefix": prefix, "Batch Date": dates.where(valid)})
+    return parsed.take(codes).set_axis(batches.index)
+
+def strip_text(values):
+    """Strip an Arrow string column; missing cells become "nan" as astype(str) gave"""
+    return values.str.strip().fillna("nan")
 
-def parse_batch(batch):
-    if isinstance(batch, str) and len(batch) >= 10:
-        batch_prefix = batch[:2]
-        try:
-            year = int("20" + batch[-2:])
-            week = int(batch[-4:-2])
-            batch_date = datetime.strptime(f"{year}-W{week}-1", "%Y-W%W-%w")
-            return batch_prefix, batch_date
-        except ValueError:
-            return batch_prefix, pd.NaT
-    return None, pd.NaT
+def write_excel_report(sheets):
+    """Stream {sheet name: DataFrame} into xlsx bytes using xlsxwriter's constant_memory mode
+
+    Rows are written one at a time with write_row because to_excel writes
+    column by column, which constant_memory silently drops.
+    """
+    output = BytesIO()
+    with xlsxwriter.Workbook(output, {
+        "constant_memory": True,
+        "strings_to_urls": False,
+        "default_date_format": "yyyy-mm-dd hh:mm:ss"
+    }) as workbook:
+        header_format = workbook.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+        for sheet_name, df in sheets.items():
+            worksheet = workbook.add_worksheet(sheet_name)
+            worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+            cells = df.astype(object).where(df.notna(), None)
+            for row_num, row in enumerate(cells.itertuples(index=False, name=None), start=1):
+                worksheet.write_row(row_num, 0, row)
+    output.seek(0)
+    return output
+
+def write_parquet(df):
+    """Serialize a DataFrame to zstd Parquet bytes (mixed-type text columns stored as strings)"""
+    text_columns = [col for col, dtype in df.dtypes.items() if dtype == object]
+    output = BytesIO()
+    df.astype({col: "string" for col in text_columns}).to_parquet(output, index=False, compression="zstd")
+    output.seek(0)
+    return output
+
+def write_parquet_bundle(sheets):
+    """Zip one Parquet file per {sheet name: DataFrame} (stored, the files are already compressed)"""
+    output = BytesIO()
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_STORED) as bundle:
+        for sheet_name, df in sheets.items():
+            file_name = sheet_name.lower().replace(" ", "_") + ".parquet"
+            bundle.writestr(file_name, write_parquet(df).getvalue())
+    output.seek(0)
+    return output
+
+# --- Preprocessing (independent of the filter selections) ---
+@st.cache_data(ttl=3600, show_spinner=False)
+def prepare_endcaps_data(uploaded_file):
+    """Load Endcaps with stripped text columns and parsed batches"""
+    endcaps_df = load_endcaps_data(uploaded_file)
+    for col in ENDCAPS_TEXT_COLUMNS:
+        endcaps_df[col] = strip_text(endcaps_df[col])
+    endcaps_df[["Batch Prefix", "Batch Date"]] = parse_batch_vectorized(endcaps_df["Batch"])
+    return endcaps_df
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def prepare_open_space_data(uploaded_file):
+    """Load Open Space with stripped text columns and parsed batches"""
+    open_space_df = load_open_space_data(uploaded_file)
+    for col in OPEN_SPACE_TEXT_COLUMNS:
+        open_space_df[col] = strip_text(open_space_df[col])
+    open_space_df[["Batch Prefix", "Batch Date"]] = parse_batch_vectorized(open_space_df["Batch Number"])
+    for col in OPEN_SPACE_COUNT_COLUMNS:
+        if open_space_df[col].dtype == np.int64:
+            open_space_df[col] = open_space_df[col].astype(np.int32)
+    return open_space_df
+
+# --- Core Processing ---
+@st.cache_data(ttl=3600, show_spinner=False)
+def process_files(endcaps_file, open_space_file, selected_types, move_into_types):
+    """Cached consolidation pipeline keyed on file contents and filter selections
+
+    Returns (final_output, summary_output, updated_open_space); the first two
+    are None when no assignments were found.
+    """
+    # Text is already stripped and batches parsed, so a filter change only reruns from here
+    endcaps_df = prepare_endcaps_data(endcaps_file)
+    open_space_df = prepare_open_space_data(open_space_file)
+    
+    # --- CORE PROCESSING (ORIGINAL ALGORITHM) ---
+    open_space_df = open_space_df[open_space_df["Storage Type"] != "VIR"]
+    endcaps_df = endcaps_df[endcaps_df["Storage Type"].isin(selected_types)]
+    
+    # Calculate SU count per storage bin
+    endcaps_df["Total Unique SU Count"] = endcaps_df.groupby("Storage Bin", sort=False)["Storage Unit"].transform("nunique")
+    
+    open_space_df.sort_values("SU Count", ascending=False, inplace=True)
+    
+    # Matching keys share categories across both files so lookups agree
+    endcaps_df["Material"], open_space_df["Material Number"] = to_shared_category(
+        endcaps_df["Material"], open_space_df["Material Number"]
+    )
+    endcaps_df["Batch Prefix"], open_space_df["Batch Prefix"] = to_shared_category(
+        endcaps_df["Batch Prefix"], open_space_df["Batch Prefix"]
+    )
+    
+    # --- DYNAMIC ASSIGNMENT LOGIC ---
+    # Same greedy order and rules as the original loop, with the per-bin state kept
+    # in arrays and dicts built below instead of refiltered frames
+    matches = []
+    excluded_target_bins = set()
+    
+    available_bins = open_space_df[
+        open_space_df["Storage Type"].isin(move_into_types) & 
+        (open_space_df["Utilization %"] < 100) &
+        (open_space_df["Avail SU"] > 0) &
+        (~open_space_df["Storage Bin"].isin(excluded_target_bins))
+    ]
+    
+    # Row positions of every (Material Number, Batch Prefix) group, so each
+    # source bin only inspects its own candidates instead of scanning all bins
+    candidate_positions = available_bins.groupby(
+        ["Material Number", "Batch Prefix"], observed=True, sort=False
+    ).indices
+    no_candidates = np.array([], dtype=np.intp)
+    
+    # Per-row state of the available bins kept in arrays: remaining Avail SU, batch
+    # day, and whether the row can still be a target (dated and not excluded).
+    # Updates go through a bin -> rows dict instead of masking the whole frame
+    avail_su = available_bins["Avail SU"].to_numpy().copy()
+    target_days = available_bins["Batch Date"].to_numpy(dtype="datetime64[D]")
+    open_rows = ~np.isnat(target_days)
+    target_bins = available_bins["Storage Bin"].to_numpy()
+    bin_positions = available_bins.groupby("Storage Bin", sort=False).indices
+    
+    # Oldest / newest batch per target (bin, material, prefix) and per source bin
+    dated_targets = available_bins.dropna(subset=["Batch Date"])
+    target_range = dated_targets.groupby(
+        ["Storage Bin", "Material Number", "Batch Prefix"], observed=True, sort=False
+    )["Batch Date"].agg(["idxmin", "idxmax"])
+    target_batch_range = dict(zip(target_range.index, zip(
+        dated_targets.loc[target_range["idxmin"], "Batch Number"],
+        dated_targets.loc[target_range["idxmax"], "Batch Number"]
+    )))
+    dated_sources = endcaps_df.dropna(subset=["Batch Date"])
+    source_range = dated_sources.groupby("Storage Bin", sort=False)["Batch Date"].agg(["idxmin", "idxmax"])
+    source_batch_range = dict(zip(source_range.index, zip(
+        dated_sources.loc[source_range["idxmin"], "Batch"],
+        dated_sources.loc[source_range["idxmax"], "Batch"]
+    )))
+    
+    # Batch date span per source bin; a bin with any undated SU never qualifies
+    source_dates = endcaps_df.groupby("Storage Bin", sort=False)["Batch Date"].agg(["min", "max", "count", "size"])
+    fully_dated = source_dates["count"] == source_dates["size"]
+    source_date_span = dict(zip(
+        source_dates.index[fully_dated],
+        source_dates.loc[fully_dated, ["min", "max"]].to_numpy(dtype="datetime64[D]")
+    ))
+    
+    source_positions = endcaps_df.groupby("Storage Bin", sort=False).indices
+    # Scalars from each bin's first row, looked up once instead of via .iloc per iteration
+    bin_heads = endcaps_df.drop_duplicates("Storage Bin")
+    bin_head_values = dict(zip(bin_heads["Storage Bin"], zip(
+        bin_heads["Storage Type"],
+        bin_heads["Material"],
+        bin_heads["Batch Prefix"],
+        bin_heads["Total Unique SU Count"]
+    )))
+    # Source bins by ascending SU count, ties broken by bin name
+    sorted_endcap_bins = bin_heads.sort_values(
+        ["Total Unique SU Count", "Storage Bin"]
+    )["Storage Bin"].to_numpy()
+    # Avail SU only ever decreases, so once a bin outgrows the roomiest target
+    # every later (larger) bin does too
+    largest_avail_su = avail_su[open_rows].max(initial=0)
+    
+    # Each source bin is visited once (sorted_endcap_bins is deduplicated), so
+    # there is no separate used-source set to check
+    for storage_bin in sorted_endcap_bins:
+        su_date_span = source_date_span.get(storage_bin)
+        if su_date_span is None:
+            continue
+        su_oldest, su_newest = su_date_span
+        
+        _, material, batch_prefix, total_su_in_bin = bin_head_values[storage_bin]
+        if total_su_in_bin > largest_avail_su:
+            break
+        
+        positions = candidate_positions.get((material, batch_prefix), no_candidates)
+        usable = open_rows[positions] & (avail_su[positions] >= total_su_in_bin)
+        own_rows = bin_positions.get(storage_bin, no_candidates)
+        if own_rows.size:
+            usable &= ~np.isin(positions, own_rows)
+        positions = positions[usable]
+        
+        if positions.size == 0:
+            continue
+        
+        # Every SU batch must be within 364 days of every candidate batch, which
+        # holds iff the two extreme pairs are
+        target_dates = target_days[positions]
+        widest_gap = max(target_dates.max() - su_oldest, su_newest - target_dates.min())
+        if widest_gap > np.timedelta64(364, "D"):
+            continue
+        
+        # Record the move; output rows are built from these after the loop
+        target_row = positions[0]
+        matches.append((storage_bin, target_row, avail_su[target_row], total_su_in_bin))
+        
+        excluded_target_bins.add(storage_bin)
+        open_rows[own_rows] = False
+        avail_su[bin_positions.get(target_bins[target_row], no_candidates)] -= total_su_in_bin
+    
+    available_bins["Avail SU"] = avail_su
+    remaining_bins = available_bins[~available_bins["Storage Bin"].isin(excluded_target_bins)]
+    # Copy the remaining Avail SU back by bin in one map (the last row of a bin wins)
+    updated_avail_su = remaining_bins.dropna(subset=["Storage Bin"]).drop_duplicates(
+        "Storage Bin", keep="last"
+    ).set_index("Storage Bin")["Avail SU"]
+    updated_rows = open_space_df["Storage Bin"].isin(updated_avail_su.index)
+    open_space_df.loc[updated_rows, "Avail SU"] = open_space_df.loc[updated_rows, "Storage Bin"].map(updated_avail_su)
+    
+    # --- OUTPUT GENERATION WITH CORRECT COLUMN ORDERING ---
+    if not matches:
+        return None, None, open_space_df
+    
+    moves = pd.DataFrame.from_records(
+        matches, columns=["FROM LOC", "target_row", "AVAILABLE SU", "SUs TO MOVE"]
+    )
+    targets = available_bins.iloc[moves["target_row"]].reset_index(drop=True)
+    source_details = pd.DataFrame.from_records(
+        [bin_head_values[storage_bin][:2] + source_batch_range[storage_bin] for storage_bin in moves["FROM LOC"]],
+        columns=["FROM STORAGE TYPE", "Material", "FROM OLDEST BATCH", "FROM NEWEST BATCH"]
+    )
+    target_details = pd.DataFrame.from_records(
+        [target_batch_range[key] for key in zip(targets["Storage Bin"], targets["Material Number"], targets["Batch Prefix"])],
+        columns=["TO OLDEST BATCH", "TO NEWEST BATCH"]
+    )
+    target_columns = {
+        "Storage Type": "TO STORAGE TYPE",
+        "Storage Bin": "TO LOC",
+        "SU Capacity": "SU CAPACITY",
+        "SU Count": "CURRENT SU COUNT"
+    }
+    
+    # One summary row per move
+    summary_output = pd.concat([
+        moves,
+        source_details,
+        target_details,
+        targets[list(target_columns)].rename(columns=target_columns)
+    ], axis=1)[SUMMARY_COLUMNS]
+    
+    # One assignment row per SU in each moved bin, with the move's values repeated
+    su_rows = [source_positions[storage_bin] for storage_bin in moves["FROM LOC"]]
+    moved_sus = endcaps_df.iloc[np.concatenate(su_rows)]
+    per_su = summary_output.loc[summary_output.index.repeat([len(rows) for rows in su_rows])]
+    final_output = pd.DataFrame({
+        "FROM STORAGE TYPE": moved_sus["Storage Type"].to_numpy(),
+        "TO STORAGE TYPE": per_su["TO STORAGE TYPE"].to_numpy(),
+        "Material": moved_sus["Material"].to_numpy(),
+        "TO BATCH": per_su["TO OLDEST BATCH"].to_numpy(),
+        "FROM BATCH": moved_sus["Batch"].to_numpy(),
+        "SU CAPACITY": per_su["SU CAPACITY"].to_numpy(),
+        "SU COUNT": 1,
+        "AVAILABLE SU": (per_su["AVAILABLE SU"] - per_su["SUs TO MOVE"]).to_numpy(),
+        "LP#": moved_sus["Storage Unit"].to_numpy(),
+        "RACK QTY": moved_sus["Total Stock"].to_numpy(),
+        "FROM LOC": per_su["FROM LOC"].to_numpy(),
+        "TO LOC": per_su["TO LOC"].to_numpy()
+    })
+    
+    return final_output, summary_output, open_space_df
 
 # --- Streamlit UI ---
 st.set_page_config(layout="wide", page_title="Inventory Consolidation Tool")
@@ -37,8 +394,22 @@ def validate_excel_file(uploaded_file):
     if not uploaded_file.name.lower().endswith('.xlsx'):
         st.error(f"Invalid file type: {uploaded_file.name}. Please upload an .xlsx file")
         return None
+    # .xlsx is a zip archive; check the signature so renamed files fail here, not in the parser
+    uploaded_file.seek(0)
+    signature = uploaded_file.read(4)
+    uploaded_file.seek(0)
+    if signature != b"PK\x03\x04":
+        st.error(f"{uploaded_file.name} is not a valid .xlsx workbook")
+        return None
     return uploaded_file
 
+def has_required_columns(uploaded_file, columns, required_columns):
+    """Helper function to report required columns missing from a loaded file"""
+    missing = [col for col in required_columns if col not in columns]
+    if missing:
+        st.error(f"{uploaded_file.name} is missing required columns: {', '.join(missing)}")
+    return not missing
+
 # File Upload with custom validation
 with st.expander("📂 STEP 1: Upload Files", expanded=True):
     col1, col2 = st.columns(2)
@@ -61,222 +432,91 @@ with st.expander("📂 STEP 1: Upload Files", expanded=True):
 # Only proceed if both files are valid
 if endcaps_file and open_space_file:
     try:
-        # Load data with caching
+        # Load data with caching; only the column names and storage type lists are
+        # kept here, the frames themselves stay in the cache until processing
         with st.spinner("Loading Endcaps data..."):
-            endcaps_df = load_endcaps_data(endcaps_file).copy()
+            endcaps_columns = load_endcaps_columns(endcaps_file)
         with st.spinner("Loading Open Space data..."):
-            open_space_df = load_open_space_data(open_space_file).copy()
+            open_space_columns = load_open_space_columns(open_space_file)
         
-        # Get storage types from data
-        storage_types = sorted(endcaps_df["Storage Type"].dropna().unique())
-        move_into_types = sorted(open_space_df["Storage Type"].dropna().unique())
+        # Check the headers of the parsed files before anything reads those columns
+        endcaps_ok = has_required_columns(endcaps_file, endcaps_columns, ENDCAPS_COLUMNS)
+        open_space_ok = has_required_columns(open_space_file, open_space_columns, OPEN_SPACE_COLUMNS)
+        if not (endcaps_ok and open_space_ok):
+            st.stop()
         
-        # Configuration
-        with st.expander("⚙️ STEP 2: Configure Filters", expanded=True):
-            cols = st.columns(2)
-            with cols[0]:
-                selected_types = st.multiselect(
-                    "Filter these storage types (Endcaps):",
-                    options=storage_types,
-                    default=storage_types,
-                    help="Only process these storage types from Endcaps",
-                    key="endcap_types_filter"
-                )
-            with cols[1]:
-                move_into_types = st.multiselect(
-                    "Move into these storage types (Open Space):",
-                    options=move_into_types,
-                    default=move_into_types,
-                    help="Only consider these storage types in Open Space",
-                    key="openspace_types_filter"
+        storage_types = load_endcaps_storage_types(endcaps_file)
+        move_into_types = load_open_space_storage_types(open_space_file)
+        
+        # Configuration, in a form so picking storage types doesn't rerun the
+        # script on every click; the selections are applied together on Process
+        with st.form("selection_form"):
+            with st.expander("⚙️ STEP 2: Configure Filters", expanded=True):
+                cols = st.columns(2)
+                with cols[0]:
+                    selected_types = st.multiselect(
+                        "Filter these storage types (Endcaps):",
+                        options=storage_types,
+                        default=storage_types,
+                        help="Only process these storage types from Endcaps",
+                        key="endcap_types_filter"
+                    )
+                with cols[1]:
+                    move_into_types = st.multiselect(
+                        "Move into these storage types (Open Space):",
+                        options=move_into_types,
+                        default=move_into_types,
+                        help="Only consider these storage types in Open Space",
+                        key="openspace_types_filter"
+                    )
+                output_format = st.radio(
+                    "Output format:",
+                    options=["Excel", "Parquet", "Both"],
+                    horizontal=True,
+                    help="Parquet is much faster to write and smaller; it downloads as a zip with one file per sheet",
+                    key="output_format"
                 )
+            submitted = st.form_submit_button("🚀 Process Files", type="primary", help="Run the consolidation algorithm")
         
-        if st.button("🚀 Process Files", type="primary", help="Run the consolidation algorithm"):
+        if submitted:
             with st.spinner("Crunching numbers..."):
-                # --- CORE PROCESSING (ORIGINAL ALGORITHM) ---
-                open_space_df = open_space_df[open_space_df["Storage Type"] != "VIR"].copy()
-                endcaps_df = endcaps_df[endcaps_df["Storage Type"].isin(selected_types)].copy()
-                
-                # Calculate SU count per storage bin
-                endcaps_df["Storage Unit"] = endcaps_df["Storage Unit"].astype(str).str.strip()
-                endcaps_df["Storage Bin"] = endcaps_df["Storage Bin"].astype(str).str.strip()
-                su_count_per_bin = endcaps_df.groupby("Storage Bin")["Storage Unit"].nunique().reset_index()
-                su_count_per_bin.columns = ["Storage Bin", "Total Unique SU Count"]
-                endcaps_df = endcaps_df.merge(su_count_per_bin, on="Storage Bin", how="left")
-                endcaps_df.sort_values("Total Unique SU Count", ascending=True, inplace=True)
-                
-                open_space_df.sort_values("SU Count", ascending=False, inplace=True)
-                
-                # Standardize and parse batches
-                endcaps_df["Material"] = endcaps_df["Material"].astype(str).str.strip()
-                open_space_df["Material Number"] = open_space_df["Material Number"].astype(str).str.strip()
-                endcaps_df["Batch"] = endcaps_df["Batch"].astype(str).str.strip()
-                open_space_df["Batch Number"] = open_space_df["Batch Number"].astype(str).str.strip()
-                
-                endcaps_df[["Batch Prefix", "Batch Date"]] = endcaps_df["Batch"].apply(parse_batch).apply(pd.Series)
-                open_space_df[["Batch Prefix", "Batch Date"]] = open_space_df["Batch Number"].apply(parse_batch).apply(pd.Series)
-                
-                endcaps_df["Batch Date"] = pd.to_datetime(endcaps_df["Batch Date"], errors='coerce')
-                open_space_df["Batch Date"] = pd.to_datetime(open_space_df["Batch Date"], errors='coerce')
-                
-                # --- DYNAMIC ASSIGNMENT LOGIC (UNCHANGED) ---
-                assignments = []
-                summary_data = []
-                used_source_bins = set()
-                excluded_target_bins = set()
-                
-                available_bins = open_space_df[
-                    open_space_df["Storage Type"].isin(move_into_types) & 
-                    (open_space_df["Utilization %"] < 100) &
-                    (open_space_df["Avail SU"] > 0) &
-                    (~open_space_df["Storage Bin"].isin(excluded_target_bins))
-                ].copy()
-                
-                sorted_endcap_bins = endcaps_df.groupby("Storage Bin").first().sort_values("Total Unique SU Count").index
-                
-                for storage_bin in sorted_endcap_bins:
-                    if storage_bin in used_source_bins:
-                        continue
-                        
-                    bin_group = endcaps_df[endcaps_df["Storage Bin"] == storage_bin]
-                    total_su_in_bin = bin_group["Total Unique SU Count"].iloc[0]
-                    
-                    matching_bins = available_bins[
-                        (available_bins["Material Number"] == bin_group["Material"].iloc[0]) & 
-                        (available_bins["Batch Prefix"] == bin_group["Batch Prefix"].iloc[0]) & 
-                        (available_bins["Storage Bin"] != storage_bin) &
-                        (available_bins["Avail SU"] >= total_su_in_bin)
-                    ].copy()
-                    
-                    matching_bins = matching_bins.dropna(subset=["Batch Date"])
-                    
-                    for _, open_space_bin in matching_bins.iterrows():
-                        valid_match = True
-                        for _, su_row in bin_group.iterrows():
-                            su_batch_date = su_row["Batch Date"]
-                            if pd.isna(su_batch_date):
-                                valid_match = False
-                                break
-                                
-                            date_diffs = abs((matching_bins["Batch Date"] - su_batch_date).dt.days)
-                            if any(date_diffs > 364):
-                                valid_match = False
-                                break
-                                
-                        if valid_match:
-                            if open_space_bin["Avail SU"] - total_su_in_bin < 0:
-                                continue
-                                
-                            target_batches = available_bins[
-                                (available_bins["Storage Bin"] == open_space_bin["Storage Bin"]) & 
-                                (available_bins["Material Number"] == open_space_bin["Material Number"]) & 
-                                (available_bins["Batch Prefix"] == open_space_bin["Batch Prefix"])
-                            ]
-                            oldest_target = target_batches.loc[target_batches["Batch Date"].idxmin(), "Batch Number"]
-                            newest_target = target_batches.loc[target_batches["Batch Date"].idxmax(), "Batch Number"]
-                            
-                            for _, su_row in bin_group.iterrows():
-                                assignments.append([
-                                    open_space_bin["Storage Type"],      # 0 - TO STORAGE TYPE
-                                    open_space_bin["Storage Bin"],       # 1 - TO LOC
-                                    storage_bin,                         # 2 - FROM LOC
-                                    su_row["Storage Type"],              # 3 - FROM STORAGE TYPE
-                                    su_row["Material"],                  # 4 - Material
-                                    oldest_target,                       # 5 - TO BATCH
-                                    su_row["Batch"],                     # 6 - FROM BATCH
-                                    open_space_bin["SU Capacity"],       # 7 - SU CAPACITY
-                                    1,                                   # 8 - SU COUNT
-                                    open_space_bin["Avail SU"] - total_su_in_bin, # 9 - AVAILABLE SU
-                                    su_row["Storage Unit"],              # 10 - LP#
-                                    su_row["Total Stock"]                # 11 - RACK QTY
-                                ])
-                            
-                            oldest_source = bin_group.loc[bin_group["Batch Date"].idxmin(), "Batch"]
-                            newest_source = bin_group.loc[bin_group["Batch Date"].idxmax(), "Batch"]
-                            summary_data.append([
-                                open_space_bin["Storage Type"],          # 0 - TO STORAGE TYPE
-                                bin_group["Storage Type"].iloc[0],       # 1 - FROM STORAGE TYPE
-                                open_space_bin["Storage Bin"],           # 2 - TO LOC
-                                storage_bin,                             # 3 - FROM LOC
-                                bin_group["Material"].iloc[0],           # 4 - Material
-                                oldest_target,                           # 5 - TO OLDEST BATCH
-                                newest_target,                           # 6 - TO NEWEST BATCH
-                                oldest_source,                           # 7 - FROM OLDEST BATCH
-                                newest_source,                           # 8 - FROM NEWEST BATCH
-                                open_space_bin["SU Capacity"],           # 9 - SU CAPACITY
-                                open_space_bin["SU Count"],              # 10 - CURRENT SU COUNT
-                                open_space_bin["Avail SU"],              # 11 - AVAILABLE SU
-                                total_su_in_bin                          # 12 - SUs TO MOVE
-                            ])
-                            
-                            used_source_bins.add(storage_bin)
-                            excluded_target_bins.add(storage_bin)
-                            available_bins.loc[available_bins["Storage Bin"] == open_space_bin["Storage Bin"], "Avail SU"] -= total_su_in_bin
-                            available_bins = available_bins[~available_bins["Storage Bin"].isin(excluded_target_bins)]
-                            break
-                
-                for _, row in available_bins.iterrows():
-                    open_space_df.loc[open_space_df["Storage Bin"] == row["Storage Bin"], "Avail SU"] = row["Avail SU"]
+                final_output, summary_output, open_space_df = process_files(
+                    endcaps_file, open_space_file, tuple(selected_types), tuple(move_into_types)
+                )
                 
-                # --- OUTPUT GENERATION WITH CORRECT COLUMN ORDERING ---
-                if assignments:
-                    final_output = pd.DataFrame(
-                        data={
-                            "FROM STORAGE TYPE": [x[3] for x in assignments],
-                            "TO STORAGE TYPE": [x[0] for x in assignments],
-                            "Material": [x[4] for x in assignments],
-                            "TO BATCH": [x[5] for x in assignments],
-                            "FROM BATCH": [x[6] for x in assignments],
-                            "SU CAPACITY": [x[7] for x in assignments],
-                            "SU COUNT": [x[8] for x in assignments],
-                            "AVAILABLE SU": [x[9] for x in assignments],
-                            "LP#": [x[10] for x in assignments],
-                            "RACK QTY": [x[11] for x in assignments],
-                            "FROM LOC": [x[2] for x in assignments],
-                            "TO LOC": [x[1] for x in assignments]
-                        }
-                    )
+                if final_output is not None:
+                    report_sheets = {
+                        'Final Assignments': final_output,
+                        'Summary Report': summary_output,
+                        'Updated Open Space': open_space_df
+                    }
                     
-                    summary_output = pd.DataFrame(
-                        data={
-                            "FROM STORAGE TYPE": [x[1] for x in summary_data],
-                            "TO STORAGE TYPE": [x[0] for x in summary_data],
-                            "Material": [x[4] for x in summary_data],
-                            "FROM OLDEST BATCH": [x[7] for x in summary_data],
-                            "FROM NEWEST BATCH": [x[8] for x in summary_data],
-                            "TO OLDEST BATCH": [x[5] for x in summary_data],
-                            "TO NEWEST BATCH": [x[6] for x in summary_data],
-                            "SU CAPACITY": [x[9] for x in summary_data],
-                            "CURRENT SU COUNT": [x[10] for x in summary_data],
-                            "AVAILABLE SU": [x[11] for x in summary_data],
-                            "SUs TO MOVE": [x[12] for x in summary_data],
-                            "FROM LOC": [x[3] for x in summary_data],
-                            "TO LOC": [x[2] for x in summary_data]
-                        }
-                    )
+                    st.success(f"✅ Successfully created {len(final_output)} assignments across {len(summary_output)} target locations!")
                     
-                    output = BytesIO()
-                    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                        final_output.to_excel(writer, sheet_name='Final Assignments', index=False)
-                        summary_output.to_excel(writer, sheet_name='Summary Report', index=False)
-                        open_space_df.to_excel(writer, sheet_name='Updated Open Space', index=False)
-                    output.seek(0)
-                    
-                    st.success(f"✅ Successfully created {len(assignments)} assignments across {len(summary_data)} target locations!")
-                    
-                    st.download_button(
-                        label="📥 Download Complete Report Package",
-                        data=output,
-                        file_name="inventory_assignments.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
+                    # Only serialize the formats that were asked for
+                    if output_format in ("Excel", "Both"):
+                        st.download_button(
+                            label="📥 Download Complete Report Package",
+                            data=write_excel_report(report_sheets),
+                            file_name="inventory_assignments.xlsx",
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                        )
+                    if output_format in ("Parquet", "Both"):
+                        st.download_button(
+                            label="📥 Download Report as Parquet (.zip)",
+                            data=write_parquet_bundle(report_sheets),
+                            file_name="inventory_assignments_parquet.zip",
+                            mime="application/zip"
+                        )
                     
                     with st.expander("🔍 View Assignment Details", expanded=False):
                         st.dataframe(final_output.head(20))
                         st.info(f"Showing first 20 of {len(final_output)} assignments")
                         
                     with st.expander("📊 View Summary Report", expanded=False):
-                        st.dataframe(summary_output)
+                        st.dataframe(summary_output.head(500))
+                        if len(summary_output) > 500:
+                            st.info(f"Showing first 500 of {len(summary_output)} target locations; the download has all of them")
                         
                     with st.expander("🔄 View Updated Open Space", expanded=False):
                         st.dataframe(open_space_df.head(20))